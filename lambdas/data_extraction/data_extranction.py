@@ -1,26 +1,72 @@
 import boto3
+from botocore.config import Config
+import io
 import json
 import os
 from datetime import datetime
-import pandas as pd
+from functools import reduce
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from concurrent.futures import ThreadPoolExecutor
 import uuid
 
 boto3.setup_default_session(profile_name="etl-demo")
 
-s3 = boto3.client("s3")
-sqs = boto3.client("sqs")
-
 TEMP_BUCKET = os.environ.get("TEMP_BUCKET", "temp-recipes-bucket")
 FAILED_BUCKET = os.environ.get("FAILED_BUCKET", "failed-recipes-bucket")
 QUEUE_URL = os.environ.get("PROCESSING_QUEUE_URL", "recipe-processing-queue")
-BATCH_SIZE = os.environ.get("BATCH_SIZE", 100)
-MAX_WORKERS = os.environ.get("MAX_WORKERS", 10)
+BATCH_SIZE = int(os.environ.get("BATCH_SIZE", 100))
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", 10))
+TARGET_BATCH_BYTES = int(os.environ.get("TARGET_BATCH_BYTES", 64 * 1024 * 1024))
+
+# Size the connection pool for every extraction worker so they never wait on it
+client_config = Config(
+    max_pool_connections=MAX_WORKERS * 2,
+    tcp_keepalive=True,
+    retries={"mode": "adaptive", "max_attempts": 5},
+)
+
+s3 = boto3.client("s3", config=client_config)
+sqs = boto3.client("sqs", config=client_config)
+
+# Temp files are always read whole by the transformation step
+PARQUET_WRITE_OPTIONS = {
+    "compression": "zstd",
+    "compression_level": 3,
+    "row_group_size": 64_000,
+    "use_dictionary": True,
+    "data_page_size": 1 << 20,
+    "write_statistics": True,
+}
+
+REQUIRED_FIELDS = ["title", "ingredients", "directions"]
+
+# Maximum number of entries accepted by a single SQS send_message_batch call
+SQS_BATCH_LIMIT = 10
+
+
+def split_valid_recipes(table: pa.Table) -> tuple:
+    # A required field missing from every recipe leaves no valid rows at all
+    if not all(field in table.column_names for field in REQUIRED_FIELDS):
+        return table.schema.empty_table(), table
+
+    valid_mask = reduce(
+        pc.and_, (pc.is_valid(table[field]) for field in REQUIRED_FIELDS)
+    )
+
+    return table.filter(valid_mask), table.filter(pc.invert(valid_mask))
 
 
-def validate_raw_data(recipe) -> bool:
-    required_fields = ["title", "ingredients", "directions"]
-    return all(field in recipe for field in required_fields)
+def get_batch_size(recipes: list) -> int:
+    if not recipes:
+        return BATCH_SIZE
+
+    # Estimate the recipe size from a sample so each batch holds ~TARGET_BATCH_BYTES
+    sample = recipes[:BATCH_SIZE]
+    recipe_size = max(1, len(json.dumps(sample)) // len(sample))
+
+    return max(BATCH_SIZE, TARGET_BATCH_BYTES // recipe_size)
 
 
 def create_s3_bucket_key() -> str:
@@ -30,30 +76,49 @@ def create_s3_bucket_key() -> str:
     return f"{date_path}/{file_name}"
 
 
-def create_temp_file(recipes: list, bucket_name: str) -> str:
+def recipes_to_table(recipes: list) -> pa.Table:
+    # Table.from_pylist only infers columns from the first recipe, so collect
+    # every field seen in the batch to keep partially filled recipes intact
+    fields = dict.fromkeys(field for recipe in recipes for field in recipe)
+
+    # A batch of empty recipes still needs columns to carry its row count, so
+    # fall back to the (all null) required fields and let validation reject it
+    if not fields:
+        fields = dict.fromkeys(REQUIRED_FIELDS)
+
+    return pa.Table.from_pydict(
+        {field: [recipe.get(field) for recipe in recipes] for field in fields}
+    )
+
+
+def create_temp_file(table: pa.Table, bucket_name: str) -> str:
     temp_key = create_s3_bucket_key()
 
     print(f"Creating temp file for {bucket_name} at {temp_key}")
-    os.makedirs(os.path.dirname(temp_key), exist_ok=True)
 
-    df = pd.DataFrame(recipes)
-    df.to_parquet(temp_key)
-    s3.upload_file(temp_key, bucket_name, temp_key)
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, **PARQUET_WRITE_OPTIONS)
+    s3.put_object(Bucket=bucket_name, Key=temp_key, Body=buffer.getvalue())
 
-    os.remove(temp_key)
     return temp_key
 
 
-def send_message_to_queue(temp_key: str) -> dict:
-    response = sqs.send_message(
+def send_messages_to_queue(temp_keys: list) -> dict:
+    response = sqs.send_message_batch(
         QueueUrl=QUEUE_URL,
-        MessageBody=json.dumps(
+        Entries=[
             {
-                "source_bucket": TEMP_BUCKET,
-                "source_key": temp_key,
-                "timestamp": datetime.now().isoformat(),
+                "Id": str(index),
+                "MessageBody": json.dumps(
+                    {
+                        "source_bucket": TEMP_BUCKET,
+                        "source_key": temp_key,
+                        "timestamp": datetime.now().isoformat(),
+                    }
+                ),
             }
-        ),
+            for index, temp_key in enumerate(temp_keys)
+        ],
     )
 
     return response
@@ -61,37 +126,49 @@ def send_message_to_queue(temp_key: str) -> dict:
 
 def extract_recipe_data(recipes) -> str:
     try:
-        valid_recipes = []
-        invalid_recipes = []
-
-        for recipe in recipes:
-            if validate_raw_data(recipe):
-                valid_recipes.append(recipe)
-            else:
-                invalid_recipes.append(recipe)
+        valid_recipes, invalid_recipes = split_valid_recipes(recipes_to_table(recipes))
 
         temp_key = create_temp_file(valid_recipes, TEMP_BUCKET)
 
-        if invalid_recipes and len(invalid_recipes) > 0:
+        if invalid_recipes.num_rows > 0:
             failed_key = create_temp_file(invalid_recipes, FAILED_BUCKET)
 
             if failed_key:
                 print(f"Failed recipes saved to {failed_key}")
 
-        response = send_message_to_queue(temp_key)
-
-        if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
-            print(f"Error sending message to queue for {temp_key}: {response}")
-
         return temp_key
     except Exception as e:
         print(f"Error extracting recipe data: {e}")
         return None
 
 
+def notify_extracted_batches(temp_keys: list) -> set:
+    try:
+        response = send_messages_to_queue(temp_keys)
+    except Exception as e:
+        print(f"Error sending messages to queue for {temp_keys}: {e}")
+        return set(temp_keys)
+
+    failed_keys = set()
+    for failure in response.get("Failed", []):
+        temp_key = temp_keys[int(failure["Id"])]
+        print(f"Error sending message to queue for {temp_key}: {failure}")
+        failed_keys.add(temp_key)
+
+    return failed_keys
+
+
 def threaded_extraction(batches):
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        return list(executor.map(extract_recipe_data, batches))
+        results = list(executor.map(extract_recipe_data, batches))
+
+    # Queue the uploaded files in as few SQS calls as possible
+    temp_keys = [result for result in results if result is not None]
+    failed_keys = set()
+    for i in range(0, len(temp_keys), SQS_BATCH_LIMIT):
+        failed_keys |= notify_extracted_batches(temp_keys[i : i + SQS_BATCH_LIMIT])
+
+    return [None if result in failed_keys else result for result in results]
 
 
 def lambda_handler(event, context):
@@ -106,8 +183,9 @@ def lambda_handler(event, context):
 
         recipes = json.load(raw_data["Body"])
 
+        batch_size = get_batch_size(recipes)
         batches = [
-            recipes[i : i + BATCH_SIZE] for i in range(0, len(recipes), BATCH_SIZE)
+            recipes[i : i + batch_size] for i in range(0, len(recipes), batch_size)
         ]
 
         results = threaded_extraction(batches)
@@ -1,9 +1,14 @@
+import csv
 import json
+import math
 import os
+import threading
+from urllib.parse import unquote_plus
 import boto3
+import ijson
+import orjson
 import psycopg2
 import logging
-from psycopg2 import extras
 
 # Configure logging
 logger = logging.getLogger()
@@ -12,17 +17,49 @@ logger.setLevel(logging.INFO)
 # Initialize AWS clients
 s3_client = boto3.client('s3')
 
+# Columns written by the COPY into the staging table
+COPY_COLUMNS = [
+    'recipe_id', 'name', 'description', 'difficulty', 'prep_time',
+    'cook_time', 'servings', 'ingredients', 'instructions',
+    'tags', 'nutrition_info'
+]
+
+# Marker for NULL values in the COPY stream, so empty strings stay empty
+COPY_NULL = '\\N'
+
+# Reused across warm invocations of the same Lambda container
+_conn = None
+_table_ready = False
+
+def is_connection_alive(conn):
+    """Check that a cached connection can still run queries"""
+    if conn is None or conn.closed:
+        return False
+    
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
 def get_connection():
-    """Create a connection to the PostgreSQL database"""
+    """Return the container's PostgreSQL connection, reconnecting if needed"""
+    global _conn
+    
+    if is_connection_alive(_conn):
+        return _conn
+    
     try:
-        conn = psycopg2.connect(
+        _conn = psycopg2.connect(
             host=os.environ.get('RDS_HOST', 'localhost'),
             port=os.environ.get('RDS_PORT', 5432),
             dbname=os.environ.get('RDS_DB_NAME', 'postgres'),
             user=os.environ.get('RDS_USERNAME', 'postgres'),
             password=os.environ.get('RDS_PASSWORD', 'postgres')
         )
-        return conn
+        return _conn
     except Exception as e:
         logger.error(f"Error connecting to PostgreSQL: {e}")
         raise e
@@ -62,17 +99,82 @@ def create_table_if_not_exists(conn):
         conn.rollback()
         raise e
 
+def to_integer(value):
+    """Round float values the way PostgreSQL casts numerics to INTEGER"""
+    if isinstance(value, float):
+        return int(math.copysign(math.floor(abs(value) + 0.5), value))
+    return value
+
+def recipe_to_row(recipe):
+    """Convert a recipe into a row matching COPY_COLUMNS"""
+    row = (
+        recipe.get('recipe_id'),
+        recipe.get('name'),
+        recipe.get('description'),
+        recipe.get('difficulty'),
+        to_integer(recipe.get('prep_time')),
+        to_integer(recipe.get('cook_time')),
+        to_integer(recipe.get('servings')),
+        orjson.dumps(recipe.get('ingredients', [])).decode(),
+        orjson.dumps(recipe.get('instructions', [])).decode(),
+        orjson.dumps(recipe.get('tags', [])).decode(),
+        orjson.dumps(recipe.get('nutrition_info', {})).decode()
+    )
+    # csv.writer writes None and '' identically, so mark NULLs explicitly
+    return tuple(COPY_NULL if value is None else value for value in row)
+
+def write_copy_rows(data, pipe, result):
+    """Write recipes as CSV rows into the COPY pipe, recording any error"""
+    try:
+        with pipe:
+            writer = csv.writer(pipe)
+            for recipe in data:
+                writer.writerow(recipe_to_row(recipe))
+                result['rows'] += 1
+    except Exception as e:
+        result['error'] = e
+
 def load_data_to_postgres(conn, data, schema, table):
     """Load the recipe data to PostgreSQL"""
+    columns = ', '.join(COPY_COLUMNS)
+    
     try:
         with conn.cursor() as cur:
-            # Prepare the insert/update query (upsert)
-            insert_query = f"""
+            # Stage the batch in a temp table so it can be bulk loaded with COPY
+            cur.execute(f"""
+            CREATE TEMP TABLE recipes_stage (LIKE {schema}.{table} INCLUDING DEFAULTS)
+            ON COMMIT DROP
+            """)
+            
+            # Stream rows into COPY while the producer is still decoding them
+            read_fd, write_fd = os.pipe()
+            result = {'rows': 0, 'error': None}
+            producer = threading.Thread(
+                target=write_copy_rows,
+                args=(data, os.fdopen(write_fd, 'w', encoding='utf-8', newline=''), result)
+            )
+            producer.start()
+            
+            try:
+                with os.fdopen(read_fd, 'r', encoding='utf-8', newline='') as pipe:
+                    cur.copy_expert(
+                        f"COPY recipes_stage ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+                        pipe
+                    )
+            finally:
+                producer.join()
+            
+            # A failed producer closes the pipe early, so COPY alone can't tell
+            if result['error']:
+                raise result['error']
+            
+            # Upsert the staged rows into the target table
+            cur.execute(f"""
             INSERT INTO {schema}.{table} (
-                recipe_id, name, description, difficulty, prep_time, 
-                cook_time, servings, ingredients, instructions, 
-                tags, nutrition_info, updated_at
-            ) VALUES %s
+                {columns}, updated_at
+            )
+            SELECT {columns}, CURRENT_TIMESTAMP
+            FROM recipes_stage
             ON CONFLICT (recipe_id) 
             DO UPDATE SET 
                 name = EXCLUDED.name,
@@ -86,30 +188,9 @@ def load_data_to_postgres(conn, data, schema, table):
                 tags = EXCLUDED.tags,
                 nutrition_info = EXCLUDED.nutrition_info,
                 updated_at = CURRENT_TIMESTAMP
-            """
-            
-            # Prepare the values
-            values = []
-            for recipe in data:
-                values.append((
-                    recipe.get('recipe_id'),
-                    recipe.get('name'),
-                    recipe.get('description'),
-                    recipe.get('difficulty'),
-                    recipe.get('prep_time'),
-                    recipe.get('cook_time'),
-                    recipe.get('servings'),
-                    json.dumps(recipe.get('ingredients', [])),
-                    json.dumps(recipe.get('instructions', [])),
-                    json.dumps(recipe.get('tags', [])),
-                    json.dumps(recipe.get('nutrition_info', {})),
-                    'CURRENT_TIMESTAMP'
-                ))
-            
-            # Execute the query
-            extras.execute_values(cur, insert_query, values)
+            """)
             conn.commit()
-            logger.info(f"Successfully loaded {len(values)} recipes to PostgreSQL")
+            logger.info(f"Successfully loaded {result['rows']} recipes to PostgreSQL")
     except Exception as e:
         logger.error(f"Error loading data to PostgreSQL: {e}")
         conn.rollback()
@@ -117,35 +198,36 @@ def load_data_to_postgres(conn, data, schema, table):
 
 def lambda_handler(event, context):
     """Lambda handler for loading processed data to PostgreSQL"""
+    global _table_ready
+    
     try:
         # Get S3 bucket and object key from the event
         logger.info(f"Processing event: {json.dumps(event)}")
         
         for record in event['Records']:
             bucket = record['s3']['bucket']['name']
-            key = record['s3']['object']['key']
+            # S3 notifications URL-encode keys, e.g. difficulty_flag%3Deasy/
+            key = unquote_plus(record['s3']['object']['key'])
             
             logger.info(f"Processing file {key} from bucket {bucket}")
             
-            # Get the object from S3
+            # Stream the object from S3, decoding recipes as they arrive
             response = s3_client.get_object(Bucket=bucket, Key=key)
-            content = response['Body'].read().decode('utf-8')
-            data = json.loads(content)
+            data = ijson.items(response['Body'], 'item', use_float=True)
             
             # Connect to PostgreSQL
             conn = get_connection()
             
-            # Create table if it doesn't exist
+            # Create table if it doesn't exist, once per container
             schema = os.environ.get('RDS_SCHEMA', 'public')
             table = os.environ.get('RDS_TABLE', 'recipes')
-            create_table_if_not_exists(conn)
+            if not _table_ready:
+                create_table_if_not_exists(conn)
+                _table_ready = True
             
             # Load data to PostgreSQL
             load_data_to_postgres(conn, data, schema, table)
             
-            # Close the connection
-            conn.close()
-            
             logger.info(f"Successfully processed file {key}")
         
         return {
@@ -1,17 +1,28 @@
-import boto3
-import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
 import os
 import re
-import io
 from datetime import datetime
+from itertools import islice
 import uuid
 
-boto3.setup_default_session(profile_name="etl-demo")
-
-s3 = boto3.client("s3")
+s3_fs = pafs.S3FileSystem()
 
 PROCESSED_BUCKET = os.environ.get("PROCESSED_BUCKET", "processed-recipes-bucket")
 
+# Downstream readers scan whole files, so favour compression ratio
+PARQUET_WRITE_OPTIONS = {
+    "compression": "zstd",
+    "compression_level": 3,
+    "row_group_size": 64_000,
+    "use_dictionary": True,
+    "data_page_size": 1 << 20,
+    "write_statistics": True,
+}
+
 TIME_UNITS = {
     "hours": 3600,
     "hour": 3600,
@@ -21,60 +32,71 @@ TIME_UNITS = {
     "second": 1,
 }
 
+# Pattern to identify time units in the directions first find the number and the next word after the number
+TIME_PATTERN = re.compile(r"(\d+)\s*(\w+)")
+
+# Scores below 4 are easy, below 8 medium and anything else hard
+DIFFICULTY_THRESHOLDS = [4.0, 8.0]
+DIFFICULTY_LABELS = np.array(["easy", "medium", "hard"])
 
-def get_complexity_score(ingredients: list, directions: list) -> int:
-    return (len(directions) * 0.6) + (len(ingredients) * 0.4)
+OUTPUT_COLUMNS = [
+    "title",
+    "ingredients",
+    "directions",
+    "tags",
+    "complexity_score",
+    "difficulty_flag",
+    "time_estimate",
+    "recipe_id",
+]
 
 
-def get_difficulty_flag(complexity_score: int) -> str:
-    if complexity_score < 4:
-        return "easy"
-    elif complexity_score < 8:
-        return "medium"
-    else:
-        return "hard"
+def get_direction_time(direction: str) -> int:
+    time_estimate = 0
+    any_match = False
 
+    for match in TIME_PATTERN.finditer(direction):
+        number, unit = match.groups()
+        unit_seconds = TIME_UNITS.get(unit)
 
-def get_recipe_id() -> str:
-    return str(uuid.uuid4())
+        if unit_seconds is None:
+            continue
 
+        time_estimate += int(number) * unit_seconds
+        any_match = True
 
-def get_time_estimate(directions: list) -> int:
-    time_estimate = 0
+    if not any_match:
+        # Estimate 5 minutes if no time units are found
+        return 300
 
-    # Pattern to identify time units in the directions first find the number and the next word after the number
-    time_pattern = re.compile(r"(\d+)\s*(\w+)")
+    return time_estimate
 
-    for direction in directions:
-        matches = time_pattern.findall(direction)
 
-        any_match = False
-        for match in matches:
-            number = match[0]
-            unit = match[1]
+def get_list_lengths(column: pa.ChunkedArray) -> np.ndarray:
+    return pc.fill_null(pc.list_value_length(column), 0).to_numpy()
 
-            if unit not in TIME_UNITS:
-                continue
 
-            time_estimate += int(number) * TIME_UNITS[unit]
-            any_match = True
+def get_complexity_scores(
+    ingredients_col: pa.ChunkedArray, directions_col: pa.ChunkedArray
+) -> np.ndarray:
+    directions_len = get_list_lengths(directions_col)
+    ingredients_len = get_list_lengths(ingredients_col)
 
-        if not any_match:
-            # Estimate 5 minutes if no time units are found
-            time_estimate += 300
+    return directions_len * 0.6 + ingredients_len * 0.4
 
-    return time_estimate
 
+def get_difficulty_flags(complexity_scores: np.ndarray) -> np.ndarray:
+    return DIFFICULTY_LABELS[np.digitize(complexity_scores, DIFFICULTY_THRESHOLDS)]
 
-def transform_row(row: pd.Series) -> pd.Series:
-    row["complexity_score"] = get_complexity_score(
-        row["ingredients"], row["directions"]
+
+def compute_time_estimates(directions_col: pa.ChunkedArray) -> list:
+    # Score every direction in a single flat pass, then regroup per recipe
+    counts = pc.fill_null(pc.list_value_length(directions_col), 0).to_pylist()
+    direction_times = map(
+        get_direction_time, pc.list_flatten(directions_col).to_pylist()
     )
-    row["difficulty_flag"] = get_difficulty_flag(row["complexity_score"])
-    row["time_estimate"] = get_time_estimate(row["directions"])
-    row["recipe_id"] = get_recipe_id()
 
-    return row
+    return [sum(islice(direction_times, count)) for count in counts]
 
 
 def lambda_handler(event, context):
@@ -86,40 +108,63 @@ def lambda_handler(event, context):
         print(f"Processing file from {temp_bucket}/{temp_key}")
 
         # Read temporary Parquet file
-        temp_file = s3.get_object(Bucket=temp_bucket, Key=temp_key)
-
-        print(temp_file)
-
-        buffer = io.BytesIO(temp_file["Body"].read())
-        df = pd.read_parquet(buffer)
+        # pre_buffer coalesces and fetches the column chunks concurrently
+        table = pq.read_table(
+            f"{temp_bucket}/{temp_key}",
+            filesystem=s3_fs,
+            pre_buffer=True,
+            use_threads=True,
+        )
 
         # Data transformations
-        df = df.apply(transform_row, axis=1)
+        complexity_scores = get_complexity_scores(
+            table["ingredients"], table["directions"]
+        )
+        table = table.append_column("complexity_score", pa.array(complexity_scores))
+        table = table.append_column(
+            "difficulty_flag", pa.array(get_difficulty_flags(complexity_scores))
+        )
+        table = table.append_column(
+            "time_estimate",
+            pa.array(compute_time_estimates(table["directions"]), pa.int64()),
+        )
+        table = table.append_column(
+            "recipe_id", pa.array([uuid.uuid4().hex for _ in range(table.num_rows)])
+        )
 
         # Save only the columns we need
-        df = df[
-            [
-                "title",
-                "ingredients",
-                "directions",
-                "tags",
-                "complexity_score",
-                "difficulty_flag",
-                "time_estimate",
-                "recipe_id",
-            ]
-        ]
-
-        # Save to processed storage
-        output_key = f"{df['difficulty_flag']}/{temp_key.split('/')[-1]}"
-
-        # Save to processed storage
-        s3.put_object(Bucket=PROCESSED_BUCKET, Key=output_key, Body=df.to_parquet())
+        table = table.select(OUTPUT_COLUMNS)
+
+        # Save to processed storage, partitioned as difficulty_flag=<flag>/
+        file_stem = temp_key.split("/")[-1].removesuffix(".parquet")
+        pq.write_to_dataset(
+            table,
+            root_path=PROCESSED_BUCKET,
+            partition_cols=["difficulty_flag"],
+            filesystem=s3_fs,
+            basename_template=f"{file_stem}-{{i}}.parquet",
+            # Directory markers would trigger the loader as empty objects
+            create_dir=False,
+            **PARQUET_WRITE_OPTIONS,
+        )
 
     return {"statusCode": 200}
 
 
 if __name__ == "__main__":
+    import boto3
+
+    # Use the same local profile as the other lambdas; S3FileSystem doesn't read
+    # boto3 sessions, so hand it the resolved credentials explicitly
+    session = boto3.Session(profile_name="etl-demo")
+    credentials = session.get_credentials().get_frozen_credentials()
+    s3_fs = pafs.S3FileSystem(
+        access_key=credentials.access_key,
+        secret_key=credentials.secret_key,
+        session_token=credentials.token,
+        region=session.region_name,
+    )
+
     # Test transformation lambda
     event = {
         "Records": [